@@ -1,50 +1,131 @@
+import asyncio
 import sqlite3
+import orjson
+import threading
 from datetime import datetime
 from pathlib import Path
 from contextlib import contextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 from brain import SecondBrain
-from llm import extract_remember_content
+from llm import extract_remember_content, split_explicit_marker
 from config import BASE_DIR
 
 # === Database Setup ===
 DB_PATH = BASE_DIR / "history.db"
+OPTIMIZE_INTERVAL = 6 * 60 * 60  # seconds between PRAGMA optimize runs
 
-def init_db():
-    with get_db() as conn:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS conversations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                title TEXT
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                conversation_id INTEGER,
-                role TEXT,
-                content TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (conversation_id) REFERENCES conversations(id)
-            )
-        """)
+def open_db() -> sqlite3.Connection:
+    """Open the shared connection every write goes through.
+    
+    Autocommit mode (isolation_level=None) so transactions are explicit;
+    WAL lets reads proceed while a write is in progress.
+    """
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")
+    conn.execute("PRAGMA mmap_size=268435456")
+    return conn
 
-@contextmanager
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+def open_reader() -> sqlite3.Connection:
+    """Open a read-only connection.
+    
+    Reads must not use the writer connection: they would see its open
+    transaction, including rows that may still be rolled back. A separate
+    connection reads from a committed WAL snapshot instead.
+    """
+    conn = sqlite3.connect(
+        f"{DB_PATH.resolve().as_uri()}?mode=ro", uri=True,
+        check_same_thread=False, isolation_level=None
+    )
     conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-        conn.commit()
-    finally:
-        conn.close()
+    conn.execute("PRAGMA cache_size=-16000")
+    conn.execute("PRAGMA mmap_size=268435456")
+    return conn
+
+_local = threading.local()
+_readers: list[sqlite3.Connection] = []  # every reader() connection, closed on shutdown
+_readers_lock = threading.Lock()
+
+def reader() -> sqlite3.Connection:
+    """This thread's read-only connection, opened on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = open_reader()
+        with _readers_lock:
+            _readers.append(conn)
+    return conn
+
+def init_db(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            title TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER,
+            role TEXT,
+            content TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (conversation_id) REFERENCES conversations(id)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pending (
+            conversation_id INTEGER PRIMARY KEY,
+            content TEXT,
+            marker TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (conversation_id) REFERENCES conversations(id)
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_conv_ts
+        ON messages(conversation_id, timestamp)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conv_created
+        ON conversations(created_at DESC)
+    """)
+    # Give the planner statistics for the indexes on first creation;
+    # PRAGMA optimize keeps them current afterwards
+    has_stats = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+    ).fetchone()
+    if not has_stats:
+        conn.execute("ANALYZE")
+
+@contextmanager
+def transaction():
+    """Serialize a write transaction on the shared connection."""
+    with app.state.db_lock:
+        conn = app.state.db
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
 
 # === FastAPI App ===
 app = FastAPI(title="Second Brain")
+app.state.ready = False  # flipped once the initial index finishes
 
 # Serve static files
 static_dir = BASE_DIR / "static"
@@ -54,7 +135,6 @@ app.mount("/static", StaticFiles(directory=static_dir), name="static")
 # Global brain instance
 brain: SecondBrain = None
 current_conversation_id: int = None
-pending_remember: dict = None
 
 # === Request/Response Models ===
 class ChatRequest(BaseModel):
@@ -78,10 +158,59 @@ class ConversationSummary(BaseModel):
 async def startup():
     global brain
     print("Initializing Second Brain...")
-    init_db()
-    brain = SecondBrain()
-    brain.index_document()
-    print("Ready!")
+    app.state.db = open_db()
+    app.state.db_lock = threading.Lock()
+    init_db(app.state.db)
+    brain = SecondBrain(db=app.state.db, db_lock=app.state.db_lock)
+    app.state.index_task = asyncio.create_task(index_in_background())
+    app.state.optimize_task = asyncio.create_task(optimize_periodically())
+
+async def index_in_background():
+    """Index the document without holding up server startup."""
+    try:
+        await asyncio.to_thread(brain.index_document)
+        print("Ready!")
+    except Exception as e:
+        print(f"Initial indexing failed: {e}. Run /index to retry.")
+    finally:
+        app.state.ready = True
+
+@app.on_event("shutdown")
+async def shutdown():
+    for name in ("index_task", "optimize_task"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    
+    db = getattr(app.state, "db", None)
+    if db is not None:
+        def close():
+            # Cancelling a task doesn't stop a thread it already started, so
+            # wait for in-flight brain work and detach the connection first
+            if brain is not None:
+                brain.detach_db()
+            with app.state.db_lock:
+                app.state.db = None
+                db.execute("PRAGMA optimize")
+                db.close()
+        
+        await asyncio.to_thread(close)
+    
+    with _readers_lock:
+        for conn in _readers:
+            conn.close()
+        _readers.clear()
+
+async def optimize_periodically():
+    """Refresh planner statistics every OPTIMIZE_INTERVAL while the server runs."""
+    def optimize():
+        with app.state.db_lock:
+            if app.state.db is not None:  # closed by shutdown
+                app.state.db.execute("PRAGMA optimize")
+    
+    while True:
+        await asyncio.sleep(OPTIMIZE_INTERVAL)
+        await asyncio.to_thread(optimize)
 
 # === Routes ===
 @app.get("/")
@@ -90,16 +219,14 @@ async def root():
 
 @app.get("/api/conversations")
 async def list_conversations() -> list[ConversationSummary]:
-    with get_db() as conn:
-        rows = conn.execute("""
-            SELECT c.id, c.title, c.created_at,
-                   COUNT(m.id) as message_count
-            FROM conversations c
-            LEFT JOIN messages m ON c.id = m.conversation_id
-            GROUP BY c.id
-            ORDER BY c.created_at DESC
-            LIMIT 50
-        """).fetchall()
+    rows = reader().execute("""
+        SELECT c.id, c.title, c.created_at,
+               (SELECT COUNT(*) FROM messages m
+                WHERE m.conversation_id = c.id) as message_count
+        FROM conversations c
+        ORDER BY c.created_at DESC
+        LIMIT 50
+    """).fetchall()
     
     return [
         ConversationSummary(
@@ -113,129 +240,155 @@ async def list_conversations() -> list[ConversationSummary]:
 
 @app.get("/api/conversations/{conv_id}/messages")
 async def get_messages(conv_id: int):
-    with get_db() as conn:
-        rows = conn.execute("""
-            SELECT role, content, timestamp
-            FROM messages
-            WHERE conversation_id = ?
-            ORDER BY timestamp ASC
-        """, (conv_id,)).fetchall()
+    """Stream the conversation's messages as NDJSON, one object per line."""
+    def generate():
+        # Its own connection: the cursor lives across yields, and each
+        # chunk may be pulled from a different threadpool thread
+        conn = open_reader()
+        try:
+            cursor = conn.execute("""
+                SELECT role, content, timestamp
+                FROM messages
+                WHERE conversation_id = ?
+                ORDER BY timestamp ASC
+            """, (conv_id,))
+            for r in cursor:
+                yield orjson.dumps(dict(r)) + b"\n"
+        finally:
+            conn.close()
     
-    return [dict(r) for r in rows]
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
 
 @app.post("/api/conversations")
 async def create_conversation():
-    with get_db() as conn:
-        cursor = conn.execute(
-            "INSERT INTO conversations (title) VALUES (?)",
-            ("New Conversation",)
-        )
-        conv_id = cursor.lastrowid
+    def insert() -> int:
+        with transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO conversations (title) VALUES (?)",
+                ("New Conversation",)
+            )
+            return cursor.lastrowid
+    
+    conv_id = await asyncio.to_thread(insert)
     return {"id": conv_id}
 
 @app.delete("/api/conversations/{conv_id}")
 async def delete_conversation(conv_id: int):
-    with get_db() as conn:
-        conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conv_id,))
-        conn.execute("DELETE FROM conversations WHERE id = ?", (conv_id,))
+    def delete():
+        with transaction() as conn:
+            conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conv_id,))
+            conn.execute("DELETE FROM pending WHERE conversation_id = ?", (conv_id,))
+            conn.execute("DELETE FROM conversations WHERE id = ?", (conv_id,))
+    
+    await asyncio.to_thread(delete)
     return {"status": "deleted"}
 
 @app.post("/api/chat")
 async def chat(request: ChatRequest) -> ChatResponse:
-    global current_conversation_id, pending_remember
+    if not app.state.ready:
+        raise HTTPException(status_code=503, detail="Still indexing the document, try again shortly.")
     
     message = request.message.strip()
     conv_id = request.conversation_id
     
-    # Create conversation if needed
-    if not conv_id:
-        with get_db() as conn:
-            cursor = conn.execute(
-                "INSERT INTO conversations (title) VALUES (?)",
-                (message[:50] + "..." if len(message) > 50 else message,)
-            )
-            conv_id = cursor.lastrowid
+    # Handle pending confirmation
+    awaiting = None
+    if conv_id:
+        awaiting = reader().execute(
+            "SELECT content, marker FROM pending WHERE conversation_id = ?",
+            (conv_id,)
+        ).fetchone()
     
-    # Save user message
-    with get_db() as conn:
-        conn.execute(
-            "INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
-            (conv_id, "user", message)
+    if awaiting:
+        response_text, pending, classification = await asyncio.to_thread(
+            handle_confirmation, message, dict(awaiting)
         )
-    
-    # Handle pending confirmation
-    if pending_remember and pending_remember.get("conversation_id") == conv_id:
-        response_text, pending_confirmation, classification = handle_confirmation(message)
-        if not pending_confirmation:
-            pending_remember = None
     else:
-        response_text, pending_confirmation, classification = process_message(message, conv_id)
+        response_text, pending, classification = await asyncio.to_thread(process_message, message)
     
-    # Save assistant response
-    with get_db() as conn:
-        conn.execute(
-            "INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
-            (conv_id, "assistant", response_text)
-        )
+    conv_id = await asyncio.to_thread(
+        save_turn, conv_id, message, response_text, pending, awaiting is not None
+    )
     
     return ChatResponse(
         response=response_text,
         conversation_id=conv_id,
-        pending_confirmation=pending_confirmation,
+        pending_confirmation=pending is not None,
         classification=classification
     )
 
-def handle_confirmation(message: str) -> tuple[str, bool, dict | None]:
-    global pending_remember
+def save_turn(conv_id: int | None, message: str, response_text: str,
+              pending: dict | None, was_pending: bool) -> int:
+    """Save a chat turn in one transaction; returns the conversation id.
     
+    Runs after the LLM call, so the write lock is never held while the
+    model is generating.
+    """
+    with transaction() as conn:
+        if not conv_id:
+            cursor = conn.execute(
+                "INSERT INTO conversations (title) VALUES (?)",
+                (message[:50] + "..." if len(message) > 50 else message,)
+            )
+            conv_id = cursor.lastrowid
+        conn.executemany(
+            "INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
+            [(conv_id, "user", message), (conv_id, "assistant", response_text)]
+        )
+        if pending:
+            conn.execute(
+                "INSERT OR REPLACE INTO pending (conversation_id, content, marker) VALUES (?, ?, ?)",
+                (conv_id, pending["content"], pending["marker"])
+            )
+        elif was_pending:
+            conn.execute("DELETE FROM pending WHERE conversation_id = ?", (conv_id,))
+    return conv_id
+
+def handle_confirmation(message: str, pending: dict) -> tuple[str, dict | None, dict | None]:
+    """Resolve a pending remember. Returns (response, still-pending action, classification)."""
     lower = message.lower()
     
     if lower == "yes":
-        result = brain.confirm_remember(
-            pending_remember["content"],
-            pending_remember["marker"]
-        )
-        return result["message"], False, None
+        result = brain.confirm_remember(pending["content"], pending["marker"])
+        return result["message"], None, None
     
     elif lower == "no":
-        return "Cancelled.", False, None
+        return "Cancelled.", None, None
     
     elif message.startswith("[") and message.endswith("]"):
-        result = brain.confirm_remember(pending_remember["content"], message)
-        return result["message"], False, None
+        result = brain.confirm_remember(pending["content"], message)
+        return result["message"], None, None
     
     else:
-        return "Please type 'yes', 'no', or a specific marker like [D2:DEFINITION]", True, None
+        return "Please type 'yes', 'no', or a specific marker like [D2:DEFINITION]", pending, None
 
-def process_message(message: str, conv_id: int) -> tuple[str, bool, dict | None]:
-    global pending_remember
-    
+def process_message(message: str) -> tuple[str, dict | None, dict | None]:
+    """Handle a chat message. Returns (response, pending remember action, classification)."""
     # Commands
     if message.startswith("/"):
-        return handle_command(message), False, None
+        return handle_command(message), None, None
     
     # Remember (natural language detection)
     remember_content = extract_remember_content(message)
     if remember_content:
         content = remember_content
         
-        if " in [" in content and content.endswith("]"):
-            parts = content.rsplit(" in ", 1)
-            result = brain.confirm_remember(parts[0], parts[1])
-            return result["message"], False, None
+        explicit = split_explicit_marker(content)
+        if explicit:
+            result = brain.confirm_remember(*explicit)
+            return result["message"], None, None
         else:
             result = brain.remember(content, confirm=True)
             if result["status"] == "pending_confirmation":
-                pending_remember = {
+                pending = {
                     "content": result["content"],
-                    "marker": result["classification"]["marker"],
-                    "conversation_id": conv_id
+                    "marker": result["classification"]["marker"]
                 }
-                return result["message"], True, result["classification"]
-            return result["message"], False, None
+                return result["message"], pending, result["classification"]
+            return result["message"], None, None
     
     # Regular query
-    return brain.query(message), False, None
+    return brain.query(message), None, None
 
 def handle_command(message: str) -> str:
     cmd = message.lower().split()
@@ -290,7 +443,7 @@ Or just ask questions naturally."""
 
 @app.post("/api/reindex")
 async def reindex():
-    stats = brain.index_document()
+    stats = await asyncio.to_thread(brain.index_document)
     return {"status": "success", "stats": stats}
 
 # Run with: uvicorn app:app --reload
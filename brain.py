@@ -1,34 +1,96 @@
+import sqlite3
+import threading
+from collections import deque
+from collections.abc import Iterator
 from docs_client import DocsClient
-from parser import parse_document, get_empty_sections, get_document_stats, Section
+from parser import parse_document, get_empty_sections, get_document_stats, ParsedDoc
 from embeddings import embed_sections
 from vector_store import VectorStore
-from llm import chat, classify_section, analyze_gaps
-from config import DOC_ID, ALL_MARKERS, DOMAINS
+from llm import chat_stream, classify_section, analyze_gaps_stream
+from config import DOC_ID, EMBEDDING_MODEL, ALL_MARKERS, DOMAINS, MARKERS_BY_DOMAIN, CONCLUSION_MARKERS
 
 class SecondBrain:
-    def __init__(self):
+    def __init__(self, db: sqlite3.Connection | None = None, db_lock: "threading.Lock | None" = None):
+        """
+        Args:
+            db: Optional shared history.db connection (with a `meta` table)
+                used to remember the last indexed revision across restarts
+            db_lock: Lock serializing writes on `db`
+        """
         print("Initializing Second Brain...")
         self.docs = DocsClient()
         self.store = VectorStore()
-        self.sections: list[Section] = []
-        self.conversation_history = []
+        self.sections = ParsedDoc()
+        # Last 10 exchanges; the deque drops the oldest turns itself
+        self.conversation_history = deque(maxlen=20)
+        self.db = db
+        self.db_lock = db_lock or threading.Lock()
+        # The Docs client and the index aren't safe to mutate from several
+        # threads at once (the web app runs brain calls off the event loop)
+        self._doc_lock = threading.Lock()
         
     def index_document(self):
-        """Load document, parse sections, and build vector index."""
-        print("Fetching document from Google Docs...")
-        text = self.docs.read_document(DOC_ID)
+        """Load document, parse sections, and build vector index.
         
-        print("Parsing sections...")
-        self.sections = parse_document(text)
-        print(f"Found {len(self.sections)} sections")
-        
-        print("Building vector index (this may take a minute)...")
-        self.store.clear()
-        embedded = embed_sections(self.sections)
-        self.store.add_documents(embedded)
-        
-        print(f"Indexed {self.store.count()} sections")
-        return self.get_stats()
+        If the document's revisionId (and the embedding model) match the last
+        indexed ones, the cached text is re-parsed and the fetch + embedding
+        pass is skipped.
+        """
+        with self._doc_lock:
+            revision = self.docs.get_revision_id(DOC_ID)
+            if (revision and revision == self._get_meta("doc_revision")
+                    and self._get_meta("embedding_model") == EMBEDDING_MODEL
+                    and self.store.count()):
+                print("Document unchanged since last index, using cached copy")
+                self.sections = parse_document(self._get_meta("doc_text") or "")
+                return self.get_stats()
+            
+            print("Fetching document from Google Docs...")
+            text = self.docs.read_document(DOC_ID)
+            
+            print("Parsing sections...")
+            self.sections = parse_document(text)
+            print(f"Found {len(self.sections)} sections")
+            
+            print("Building vector index (this may take a minute)...")
+            # Only sections whose content hash changed get re-embedded
+            embedded = embed_sections(self.sections, self.store.get_content_hashes())
+            self.store.sync_documents(embedded)
+            
+            print(f"Indexed {self.store.count()} sections")
+            self._set_meta(doc_revision=revision, doc_text=text, embedding_model=EMBEDDING_MODEL)
+            return self.get_stats()
+    
+    def detach_db(self):
+        """Stop using the shared db, after any in-flight index or append finishes."""
+        with self._doc_lock:
+            self.db = None
+    
+    def _get_meta(self, key: str) -> str | None:
+        """Internal: read a value from the `meta` table (None without a db)."""
+        if self.db is None:
+            return None
+        # Under the lock so the read never lands inside another thread's
+        # open transaction on the shared connection
+        with self.db_lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def _set_meta(self, **values: str | None):
+        """Internal: upsert values into the `meta` table in one transaction."""
+        if self.db is None:
+            return
+        with self.db_lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    values.items()
+                )
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
     
     def get_stats(self) -> dict:
         """Get document completion statistics."""
@@ -36,11 +98,31 @@ class SecondBrain:
     
     def query(self, question: str, n_results: int = 5) -> str:
         """Answer a question using document content."""
-        # Search for relevant sections
-        results = self.store.search(question, n_results=n_results)
+        return "".join(self.query_stream(question, n_results=n_results))
+    
+    def query_stream(self, question: str, n_results: int = 5) -> Iterator[str]:
+        """Like query(), but yields the answer in chunks as it is generated."""
+        # Snapshot the history: other threads (web requests) may append to
+        # the deque while this one is iterating it
+        history = list(self.conversation_history)
+        
+        # Search for relevant sections. Answers given mid-conversation depend
+        # on the history, so answers are only cached and reused while there
+        # is no history yet
+        if history:
+            results, cached, cache_key = self.store.search(question, n_results=n_results), None, None
+        else:
+            results, cached, cache_key = self.store.search_with_cache(question, n_results=n_results)
+        
+        if cached is not None:
+            yield cached
+            self.conversation_history.append({"role": "user", "content": question})
+            self.conversation_history.append({"role": "assistant", "content": cached})
+            return
         
         if not results:
-            return "No relevant sections found. Try rephrasing your question."
+            yield "No relevant sections found. Try rephrasing your question."
+            return
         
         # Build context from search results
         context_parts = []
@@ -50,17 +132,17 @@ class SecondBrain:
         context = "\n\n---\n\n".join(context_parts)
         
         # Get LLM response
-        response = chat(question, context=context, history=self.conversation_history)
+        chunks = []
+        for chunk in chat_stream(question, context=context, history=history):
+            chunks.append(chunk)
+            yield chunk
+        response = "".join(chunks)
+        if cache_key is not None:
+            self.store.cache_response(cache_key, response)
         
         # Update conversation history
         self.conversation_history.append({"role": "user", "content": question})
         self.conversation_history.append({"role": "assistant", "content": response})
-        
-        # Keep history manageable
-        if len(self.conversation_history) > 20:
-            self.conversation_history = self.conversation_history[-20:]
-        
-        return response
     
     def remember(self, content: str, confirm: bool = True) -> dict:
         """Classify content and optionally add to document.
@@ -113,27 +195,47 @@ class SecondBrain:
     
     def _append_to_doc(self, content: str, marker: str) -> dict:
         """Internal: append content to document section."""
-        try:
-            success = self.docs.append_to_section(DOC_ID, marker, content, ALL_MARKERS)
-            
-            if success:
-                # Re-index just this section (optimization: could update single chunk)
-                # For now, we'll do a full re-index on next query
-                return {
-                    "status": "added",
-                    "marker": marker,
-                    "message": f"Added content to {marker}. Run 'reindex' to update search."
-                }
-            else:
+        with self._doc_lock:
+            try:
+                success = self.docs.append_to_section(DOC_ID, marker, content, ALL_MARKERS)
+                
+                if success:
+                    try:
+                        self._reindex_changed()
+                    except Exception as e:
+                        return {
+                            "status": "added",
+                            "marker": marker,
+                            "message": f"Added content to {marker}, but updating search failed: {e}. Run /index to refresh."
+                        }
+                    return {
+                        "status": "added",
+                        "marker": marker,
+                        "message": f"Added content to {marker}."
+                    }
+                else:
+                    return {
+                        "status": "error",
+                        "message": f"Failed to add content. Marker {marker} not found in document."
+                    }
+            except Exception as e:
                 return {
                     "status": "error",
-                    "message": f"Failed to add content. Marker {marker} not found in document."
+                    "message": f"Error writing to document: {str(e)}"
                 }
-        except Exception as e:
-            return {
-                "status": "error",
-                "message": f"Error writing to document: {str(e)}"
-            }
+    
+    def _reindex_changed(self):
+        """Internal: re-read the document and re-embed the sections whose content changed.
+        
+        Diffs every section, not just the one just appended to, so edits
+        made elsewhere since the last index are picked up too and the
+        stored revision really is fully indexed.
+        """
+        text = self.docs.read_document(DOC_ID)
+        self.sections = parse_document(text)
+        self.store.sync_documents(embed_sections(self.sections, self.store.get_content_hashes()))
+        
+        self._set_meta(doc_revision=self.docs.cached_revision, doc_text=text, embedding_model=EMBEDDING_MODEL)
     
     def gaps(self, domain: str = None) -> str:
         """Analyze gaps in the document.
@@ -141,6 +243,10 @@ class SecondBrain:
         Args:
             domain: Optional specific domain (D1-D6) to analyze
         """
+        return "".join(self.gaps_stream(domain))
+    
+    def gaps_stream(self, domain: str = None) -> Iterator[str]:
+        """Like gaps(), but yields the analysis as it is generated."""
         stats = self.get_stats()
         empty = get_empty_sections(self.sections)
         
@@ -149,7 +255,8 @@ class SecondBrain:
         
         if not empty:
             target = f"Domain {domain}" if domain else "document"
-            return f"No empty sections found in {target}. All sections have content."
+            yield f"No empty sections found in {target}. All sections have content."
+            return
         
         # Build summary for LLM
         summary_parts = ["Document Status:"]
@@ -164,7 +271,7 @@ class SecondBrain:
         
         summary = "\n".join(summary_parts)
         
-        return analyze_gaps(summary)
+        yield from analyze_gaps_stream(summary)
     
     def list_markers(self) -> str:
         """List all valid markers."""
@@ -174,14 +281,10 @@ class SecondBrain:
         
         for domain_key, domain_name in DOMAINS.items():
             output.append(f"\n=== {domain_key}: {domain_name} ===")
-            for marker in ALL_MARKERS:
-                if marker.startswith(f"[{domain_key}:"):
-                    output.append(f"  {marker}")
+            output.extend(f"  {marker}" for marker in MARKERS_BY_DOMAIN[domain_key])
         
         output.append("\n=== CONCLUSION ===")
-        for marker in ALL_MARKERS:
-            if marker.startswith("[CONCLUSION:"):
-                output.append(f"  {marker}")
+        output.extend(f"  {marker}" for marker in CONCLUSION_MARKERS)
         
         output.append("\n[TABLE 7]")
         
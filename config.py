@@ -13,6 +13,10 @@ DOC_ID = "YOUR_GOOGLE_DOC_ID_HERE"
 # === MODELS ===
 LLM_MODEL = "qwen2.5:14b"
 EMBEDDING_MODEL = "nomic-embed-text"
+# How long Ollama keeps the model (and its prompt KV cache) loaded between calls
+LLM_KEEP_ALIVE = "30m"
+# Context window; every call must use the same value or Ollama reloads the model
+LLM_NUM_CTX = 8192
 
 # === TEMPLATE MARKERS ===
 DOMAINS = {
@@ -60,3 +64,10 @@ def get_all_markers():
     return markers
 
 ALL_MARKERS = get_all_markers()
+
+# Markers grouped for listing: {"D1": ["[D1:DEFINITION]", ...], ...}
+MARKERS_BY_DOMAIN = {
+    domain_key: [m for m in ALL_MARKERS if m.startswith(f"[{domain_key}:")]
+    for domain_key in DOMAINS
+}
+CONCLUSION_MARKERS = [m for m in ALL_MARKERS if m.startswith("[CONCLUSION:")]
@@ -1,16 +1,38 @@
 import os
+import re
+from bisect import bisect_left
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
-from config import CREDENTIALS_FILE, TOKEN_FILE, DOC_ID
+from config import CREDENTIALS_FILE, TOKEN_FILE, DOC_ID, ALL_MARKERS
 
 SCOPES = ["https://www.googleapis.com/auth/documents"]
 
+def _extract_text(doc: dict) -> str:
+    """Concatenate every text run in the document body."""
+    return "".join(
+        elem["textRun"].get("content", "")
+        for element in doc.get("body", {}).get("content", [])
+        if "paragraph" in element
+        for elem in element["paragraph"].get("elements", [])
+        if "textRun" in elem
+    )
+
+def _compile_markers(markers: list[str]) -> re.Pattern:
+    """One alternation over all marker literals, so a single scan finds them all."""
+    return re.compile("|".join(re.escape(m) for m in markers))
+
 class DocsClient:
     def __init__(self):
         self.creds = None
         self.service = None
+        # Last fetched document and its plain text, valid while _doc_rev is current
+        self._doc_cache = None
+        self._doc_rev = None
+        self._doc_text = None
+        self._marker_hits = None
+        self._marker_re = _compile_markers(ALL_MARKERS)
         self._authenticate()
     
     def _authenticate(self):
@@ -37,31 +59,59 @@ class DocsClient:
     
     def read_document(self, doc_id: str = DOC_ID) -> str:
         """Read entire document as plain text."""
-        doc = self.service.documents().get(documentId=doc_id).execute()
-        
-        text = ""
-        for element in doc.get("body", {}).get("content", []):
-            if "paragraph" in element:
-                for elem in element["paragraph"].get("elements", []):
-                    if "textRun" in elem:
-                        text += elem["textRun"].get("content", "")
-        
-        return text
+        return self._get_document_text(doc_id)
+    
+    @property
+    def cached_revision(self) -> str | None:
+        """Revision of the cached document copy (None before the first fetch)."""
+        return self._doc_rev
+    
+    def get_revision_id(self, doc_id: str = DOC_ID) -> str | None:
+        """Get the document's current revision without downloading its body."""
+        doc = self.service.documents().get(documentId=doc_id, fields="revisionId").execute()
+        return doc.get("revisionId")
     
     def get_document_structure(self, doc_id: str = DOC_ID) -> dict:
-        """Get document with position info for editing."""
-        return self.service.documents().get(documentId=doc_id).execute()
+        """Get document with position info for editing.
+        
+        The full body is only re-downloaded when the revision has moved on
+        since the cached copy was fetched.
+        """
+        cached = self._doc_cache
+        if (cached is None or cached.get("documentId") != doc_id
+                or self.get_revision_id(doc_id) != self._doc_rev):
+            self._doc_cache = self.service.documents().get(documentId=doc_id).execute()
+            self._doc_rev = self._doc_cache.get("revisionId")
+            self._doc_text = None
+            self._marker_hits = None
+        return self._doc_cache
+    
+    def _get_document_text(self, doc_id: str) -> str:
+        """Internal: plain text of the (cached) document."""
+        doc = self.get_document_structure(doc_id)
+        if self._doc_text is None:
+            self._doc_text = _extract_text(doc)
+        return self._doc_text
+    
+    def _locate_markers(self, full_text: str, all_markers: list[str] = ALL_MARKERS) -> list[tuple[int, str]]:
+        """Internal: (position, marker) for every marker occurrence, in document order.
+        
+        Hits for the default marker set are cached with the document text.
+        """
+        if all_markers is not ALL_MARKERS and list(all_markers) != ALL_MARKERS:
+            pattern = _compile_markers(all_markers)
+        else:
+            pattern = self._marker_re
+            if full_text is self._doc_text:
+                if self._marker_hits is None:
+                    self._marker_hits = [(m.start(), m.group()) for m in pattern.finditer(full_text)]
+                return self._marker_hits
+        
+        return [(m.start(), m.group()) for m in pattern.finditer(full_text)]
     
     def find_marker_position(self, doc_id: str, marker: str) -> tuple[int, int] | None:
         """Find start and end index of a marker in the document."""
-        doc = self.get_document_structure(doc_id)
-        full_text = ""
-        
-        for element in doc.get("body", {}).get("content", []):
-            if "paragraph" in element:
-                for elem in element["paragraph"].get("elements", []):
-                    if "textRun" in elem:
-                        full_text += elem["textRun"].get("content", "")
+        full_text = self._get_document_text(doc_id)
         
         start = full_text.find(marker)
         if start == -1:
@@ -71,27 +121,19 @@ class DocsClient:
     
     def find_section_end(self, doc_id: str, marker: str, all_markers: list[str]) -> int | None:
         """Find where to insert content (before next marker or end of doc)."""
-        doc = self.get_document_structure(doc_id)
-        full_text = ""
-        
-        for element in doc.get("body", {}).get("content", []):
-            if "paragraph" in element:
-                for elem in element["paragraph"].get("elements", []):
-                    if "textRun" in elem:
-                        full_text += elem["textRun"].get("content", "")
+        full_text = self._get_document_text(doc_id)
         
         marker_pos = full_text.find(marker)
         if marker_pos == -1:
             return None
         
         # Find next marker after this one
+        hits = self._locate_markers(full_text, all_markers)
         next_marker_pos = len(full_text)
-        for m in all_markers:
-            if m == marker:
-                continue
-            pos = full_text.find(m, marker_pos + len(marker))
-            if pos != -1 and pos < next_marker_pos:
+        for pos, m in hits[bisect_left(hits, (marker_pos + len(marker), "")):]:
+            if m != marker:
                 next_marker_pos = pos
+                break
         
         # Back up to before any newlines preceding the next marker
         insert_pos = next_marker_pos
@@ -124,6 +166,9 @@ class DocsClient:
             body={"requests": requests}
         ).execute()
         
+        # Our edit moved the revision; drop the cached copy
+        self._doc_cache = None
+        
         return True
 
 
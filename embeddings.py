@@ -1,12 +1,58 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import ollama
 from config import EMBEDDING_MODEL
 from parser import Section
+from llm import OLLAMA_CLIENT
+
+# Sections sent to the embedder per request
+EMBED_BATCH_SIZE = 32
+
+# Concurrent single-text requests when the server has no batch endpoint
+EMBED_FALLBACK_WORKERS = 8
+
+# Texts longer than this aren't memoized by get_embedding
+EMBEDDING_CACHE_MAX_CHARS = 1024
 
 def get_embedding(text: str) -> list[float]:
-    """Generate embedding for a piece of text."""
-    response = ollama.embeddings(model=EMBEDDING_MODEL, prompt=text)
+    """Generate embedding for a piece of text.
+    
+    Short texts (i.e. search queries) are memoized, so a repeated question
+    skips the embedding model.
+    """
+    if len(text) > EMBEDDING_CACHE_MAX_CHARS:
+        return _embed(text)
+    return list(_cached_embedding(text))
+
+def _embed(text: str) -> list[float]:
+    """Internal: one uncached embedding call."""
+    response = OLLAMA_CLIENT.embeddings(model=EMBEDDING_MODEL, prompt=text)
     return response["embedding"]
 
+def get_embeddings(texts: list[str]) -> list[list[float]]:
+    """Generate embeddings for many texts, EMBED_BATCH_SIZE per request.
+    
+    Servers without the batch /api/embed endpoint get the texts as
+    concurrent single-text requests instead.
+    """
+    embeddings = []
+    try:
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            response = OLLAMA_CLIENT.embed(model=EMBEDDING_MODEL, input=texts[start:start + EMBED_BATCH_SIZE])
+            embeddings.extend(response["embeddings"])
+    except ollama.ResponseError as e:
+        if e.status_code != 404:
+            raise
+        with ThreadPoolExecutor(max_workers=EMBED_FALLBACK_WORKERS) as pool:
+            return list(pool.map(_embed, texts))
+    return embeddings
+
+@lru_cache(maxsize=512)
+def _cached_embedding(text: str) -> tuple[float, ...]:
+    """Internal: memoized embedding, as a tuple so cached values stay immutable."""
+    return tuple(_embed(text))
+
 def prepare_chunk_text(section: Section) -> str:
     """Prepare section for embedding with metadata prefix.
     
@@ -22,41 +68,72 @@ Section: {section.section_type}
 {section.content}
 """.strip()
 
-def embed_sections(sections: list[Section]) -> list[dict]:
+def content_hash(text: str) -> str:
+    """Digest of a chunk's text, used to detect sections that need re-embedding."""
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+def _section_record(index: int, section: Section) -> tuple[str, str, dict]:
+    """Internal: (id, chunk_text, metadata) for a section at `index` in the parsed doc."""
+    chunk_text = prepare_chunk_text(section)
+    return (
+        f"section_{index}_{section.marker}",
+        chunk_text,
+        {
+            "marker": section.marker,
+            "domain": section.domain or "none",
+            "section_type": section.section_type,
+            # The model is part of the hash so changing it re-embeds everything
+            "content_hash": content_hash(f"{EMBEDDING_MODEL}\0{chunk_text}"),
+        }
+    )
+
+def embed_sections(sections: list[Section], cached: dict[str, tuple[str, str]] | None = None) -> list[dict]:
     """Generate embeddings for all sections.
     
+    Args:
+        sections: Parsed document sections
+        cached: {marker: (content_hash, id)} as currently stored (see
+                VectorStore.get_content_hashes); sections whose id and hash
+                still match are not re-embedded
+    
     Returns list of dicts with:
         - id: unique identifier
-        - embedding: vector
-        - metadata: marker, domain, section_type
+        - embedding: vector, or None if the stored vector is still current
+        - metadata: marker, domain, section_type, content_hash
         - document: original text
     """
-    results = []
+    cached = cached or {}
     
-    for i, section in enumerate(sections):
+    # Collect (id, chunk_text, metadata) for every non-empty section
+    records = [
+        _section_record(i, section)
+        for i, section in enumerate(sections)
         # Skip empty sections (nothing to embed)
-        if not section.content or len(section.content.strip()) < 10:
-            continue
-        
-        chunk_text = prepare_chunk_text(section)
-        embedding = get_embedding(chunk_text)
-        
-        results.append({
-            "id": f"section_{i}_{section.marker}",
-            "embedding": embedding,
-            "metadata": {
-                "marker": section.marker,
-                "domain": section.domain or "none",
-                "section_type": section.section_type,
-            },
+        if section.content and len(section.content.strip()) >= 10
+    ]
+    
+    results = []
+    pending = []
+    for section_id, chunk_text, metadata in records:
+        record = {
+            "id": section_id,
+            "embedding": None,
+            "metadata": metadata,
             "document": chunk_text
-        })
-        
-        print(f"Embedded: {section.marker}")
+        }
+        results.append(record)
+        if cached.get(metadata["marker"]) != (metadata["content_hash"], section_id):
+            pending.append(record)
     
+    # Embed every changed section in as few requests as possible
+    embeddings = get_embeddings([r["document"] for r in pending])
+    for record, embedding in zip(pending, embeddings):
+        record["embedding"] = embedding
+        print(f"Embedded: {record['metadata']['marker']}")
+    
+    print(f"Reused {len(results) - len(pending)} unchanged embeddings")
     return results
 
-
 # Test
 if __name__ == "__main__":
     # Quick test of embedding
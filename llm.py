@@ -1,7 +1,12 @@
 import ollama
 import json
 import re
-from config import LLM_MODEL, DOMAINS, DOMAIN_SECTIONS, ALL_MARKERS
+from collections.abc import Iterable, Iterator
+from config import LLM_MODEL, LLM_KEEP_ALIVE, LLM_NUM_CTX, DOMAINS, DOMAIN_SECTIONS, ALL_MARKERS
+
+# The process's one Ollama client (and HTTP connection pool), shared with
+# embeddings.py; the host comes from OLLAMA_HOST like the module-level helpers
+OLLAMA_CLIENT = ollama.Client()
 
 # === Natural Language Intent Detection ===
 REMEMBER_PATTERNS = [
@@ -27,26 +32,49 @@ REMEMBER_PATTERNS = [
     r"^jot\s+(?:this\s+)?down[:\s]*(.+)",
 ]
 
+# All patterns as one alternation, compiled once; each alternative keeps its
+# single capture group, and alternatives are tried in list order
+_REMEMBER_RE = re.compile("|".join(f"(?:{p})" for p in REMEMBER_PATTERNS), re.IGNORECASE)
+
+# Every word a REMEMBER_PATTERNS match can start with (keep in sync), so
+# ordinary questions are turned away without running the regex
+_REMEMBER_FIRSTWORDS = frozenset({
+    "remember", "add", "save", "note", "record", "store", "put", "write",
+    "log", "keep", "insert", "please", "can", "i", "let's", "let", "don't",
+    "dont", "make", "jot",
+})
+
 def extract_remember_content(message: str) -> str | None:
     """
     Check if message is a remember/add intent and extract the content.
     Returns the content to remember, or None if not a remember intent.
     """
-    lower_msg = message.lower().strip()
-    
-    for pattern in REMEMBER_PATTERNS:
-        match = re.match(pattern, lower_msg, re.IGNORECASE)
-        if match:
-            content = match.group(1).strip()
-            if content:
-                # Return original case version
-                # Find where the content starts in original message
-                lower_content_start = lower_msg.find(content.lower())
-                if lower_content_start != -1:
-                    return message[lower_content_start:].strip()
-                return content
-    
-    return None
+    stripped = message.strip()
+    
+    words = stripped.split(None, 1)
+    if not words or words[0].lower().rstrip(",:") not in _REMEMBER_FIRSTWORDS:
+        return None
+    
+    # Matched on the original text (the pattern ignores case), so the
+    # note keeps its casing
+    match = _REMEMBER_RE.match(stripped)
+    if not match:
+        return None
+    
+    group = next(i for i, g in enumerate(match.groups(), 1) if g is not None)
+    content = stripped[match.start(group):].strip()
+    return content or None
+
+# "note text in [D2:DEFINITION]" -> ("note text", "[D2:DEFINITION]")
+_REMEMBER_MARKER_RE = re.compile(r"^(.*) in (\[[^\]]+\])\s*$", re.DOTALL)
+
+def split_explicit_marker(content: str) -> tuple[str, str] | None:
+    """
+    Split remember content that names its section, e.g. "X in [D1:DEFINITION]".
+    Returns (note, marker), or None if no marker was given.
+    """
+    match = _REMEMBER_MARKER_RE.match(content)
+    return match.groups() if match else None
 
 def is_remember_intent(message: str) -> bool:
     """Quick check if message looks like a remember intent."""
@@ -73,8 +101,21 @@ You help the user:
 
 Always be concise and precise. When classifying content to sections, explain your reasoning briefly."""
 
-def chat(user_message: str, context: str = "", history: list = None) -> str:
+# Shared by every call so the loaded model is never reconfigured
+_OPTIONS = {"num_ctx": LLM_NUM_CTX}
+
+def chat(user_message: str, context: str = "", history: Iterable[dict] = None) -> str:
     """Send a message to the LLM with optional context."""
+    return "".join(chat_stream(user_message, context=context, history=history))
+
+def chat_stream(user_message: str, context: str = "", history: Iterable[dict] = None) -> Iterator[str]:
+    """Like chat(), but yields the response in chunks as they are generated.
+    
+    The system prompt and history come first and the per-question document
+    context goes in the final user turn, so the system prompt and earlier
+    history stay a stable prefix across turns that Ollama can reuse.
+    Callers should only ever append to `history`, never reorder it.
+    """
     messages = [{"role": "system", "content": SYSTEM_PROMPT}]
     
     if history:
@@ -92,8 +133,34 @@ User question: {user_message}"""
     
     messages.append({"role": "user", "content": full_message})
     
-    response = ollama.chat(model=LLM_MODEL, messages=messages)
-    return response["message"]["content"]
+    for chunk in OLLAMA_CLIENT.chat(
+        model=LLM_MODEL,
+        messages=messages,
+        options=_OPTIONS,
+        keep_alive=LLM_KEEP_ALIVE,
+        stream=True
+    ):
+        yield chunk["message"]["content"]
+
+# JSON schema for classify_section; Ollama constrains decoding to it, and the
+# enum guarantees the marker is a valid one
+CLASSIFICATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "marker": {"type": "string", "enum": ALL_MARKERS},
+        "domain": {"enum": [*DOMAINS, None]},
+        "section_type": {"type": "string"},
+        "confidence": {"type": "string", "enum": ["high", "medium", "low"]},
+        "reasoning": {"type": "string"},
+    },
+    "required": ["marker", "domain", "section_type", "confidence", "reasoning"],
+}
+
+# Marker list for the classify prompt: one per line, no JSON quoting
+_MARKER_LIST = "\n".join(ALL_MARKERS)
+
+# Notes classified per LLM call; bounded so the prompt stays well inside num_ctx
+CLASSIFY_BATCH_SIZE = 8
 
 def classify_section(content: str) -> dict:
     """Determine which section a piece of content belongs to.
@@ -107,51 +174,82 @@ def classify_section(content: str) -> dict:
             "reasoning": "..."
         }
     """
-    prompt = f"""Classify this research note into the appropriate section of the ELSA document.
+    return classify_sections([content])[0]
+
+def classify_sections(contents: list[str]) -> list[dict]:
+    """Classify several notes, sharing one prompt per CLASSIFY_BATCH_SIZE notes.
+    
+    Returns one classification (as in classify_section) per note, in order.
+    """
+    results = []
+    for start in range(0, len(contents), CLASSIFY_BATCH_SIZE):
+        results.extend(_classify_batch(contents[start:start + CLASSIFY_BATCH_SIZE]))
+    return results
+
+def _classify_batch(contents: list[str]) -> list[dict]:
+    """Internal: classify up to CLASSIFY_BATCH_SIZE notes in a single call."""
+    notes = "\n".join(f'{i}. "{content}"' for i, content in enumerate(contents, 1))
+    
+    prompt = f"""Classify each research note into the appropriate section of the ELSA document.
 
-Content to classify:
-"{content}"
+Notes to classify:
+{notes}
 
 Available markers:
-{json.dumps(ALL_MARKERS, indent=2)}
-
-Respond in JSON format:
-{{
-    "marker": "[exact marker from list]",
-    "domain": "D1-D6 or null",
-    "section_type": "section name",
-    "confidence": "high/medium/low",
-    "reasoning": "brief explanation"
-}}
+{_MARKER_LIST}
 
-Return ONLY valid JSON, no other text."""
+Answer in JSON with one classification per note, in the same order: the marker, its domain (D1-D6, or null outside the domains), the section name, your confidence, and a brief reasoning."""
 
-    response = ollama.chat(
+    # Wrap the array in an object and pin its length to the number of notes
+    schema = {
+        "type": "object",
+        "properties": {
+            "classifications": {
+                "type": "array",
+                "items": CLASSIFICATION_SCHEMA,
+                "minItems": len(contents),
+                "maxItems": len(contents),
+            }
+        },
+        "required": ["classifications"],
+    }
+    
+    response = OLLAMA_CLIENT.chat(
         model=LLM_MODEL,
         messages=[
-            {"role": "system", "content": "You are a precise classifier. Return only valid JSON."},
+            {"role": "system", "content": "You are a precise classifier."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        format=schema,
+        options=_OPTIONS,
+        keep_alive=LLM_KEEP_ALIVE
     )
     
+    # Decoding is constrained to the schema, so this only fails on a
+    # truncated generation
     try:
-        # Try to parse JSON from response
-        text = response["message"]["content"]
-        # Handle markdown code blocks
-        if "```json" in text:
-            text = text.split("```json")[1].split("```")[0]
-        elif "```" in text:
-            text = text.split("```")[1].split("```")[0]
-        return json.loads(text.strip())
-    except json.JSONDecodeError:
-        return {
-            "marker": None,
-            "error": "Failed to parse classification",
-            "raw_response": response["message"]["content"]
-        }
+        classifications = json.loads(response["message"]["content"])["classifications"]
+    except (json.JSONDecodeError, KeyError):
+        classifications = []
+    
+    if len(classifications) != len(contents):
+        return [
+            {
+                "marker": None,
+                "error": "Failed to parse classification",
+                "raw_response": response["message"]["content"]
+            }
+            for _ in contents
+        ]
+    
+    return classifications
 
 def analyze_gaps(sections_summary: str) -> str:
     """Analyze document completeness and suggest what's missing."""
+    return "".join(analyze_gaps_stream(sections_summary))
+
+def analyze_gaps_stream(sections_summary: str) -> Iterator[str]:
+    """Like analyze_gaps(), but yields the analysis as it is generated."""
     prompt = f"""Analyze this ELSA document status and identify gaps:
 
 {sections_summary}
@@ -163,7 +261,7 @@ For each empty or incomplete section, explain:
 
 Be specific and actionable."""
 
-    return chat(prompt)
+    yield from chat_stream(prompt)
 
 def generate_summary(content: str, section_type: str) -> str:
     """Generate a concise summary of section content."""
@@ -1,5 +1,5 @@
 from brain import SecondBrain
-from llm import extract_remember_content
+from llm import extract_remember_content, split_explicit_marker
 
 HELP_TEXT = """
 Second Brain Commands:
@@ -27,6 +27,55 @@ For normal use, just type naturally:
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 """
 
+# === Commands ===
+# Each handler takes (brain, args) and prints its output.
+# Returning True ends the session.
+
+def _cmd_help(brain, args):
+    print(HELP_TEXT)
+
+def _cmd_quit(brain, args):
+    print("Goodbye!")
+    return True
+
+def _cmd_index(brain, args):
+    print("\nRe-indexing document...")
+    stats = brain.index_document()
+    print(f"Done! {stats['complete_sections']}/{stats['total_sections']} sections indexed.\n")
+
+def _cmd_stats(brain, args):
+    stats = brain.get_stats()
+    print(f"\nDocument Statistics:")
+    print(f"  Total sections: {stats['total_sections']}")
+    print(f"  Complete: {stats['complete_sections']}")
+    print(f"  Empty: {stats['empty_sections']}")
+    print(f"\nBy domain:")
+    for d, s in stats['domains'].items():
+        print(f"  {d}: {s['complete']}/{s['total']} complete")
+    print()
+
+def _cmd_gaps(brain, args):
+    domain = args[0].upper() if args else None
+    if domain and domain not in ["D1", "D2", "D3", "D4", "D5", "D6"]:
+        print(f"\nInvalid domain: {domain}. Use D1-D6.\n")
+        return
+    print("\nAnalyzing gaps...\n")
+    for chunk in brain.gaps_stream(domain):
+        print(chunk, end="", flush=True)
+    print("\n")
+
+def _cmd_markers(brain, args):
+    print(brain.list_markers())
+
+_CMDS = {
+    "/help": _cmd_help,
+    "/quit": _cmd_quit,
+    "/index": _cmd_index,
+    "/stats": _cmd_stats,
+    "/gaps": _cmd_gaps,
+    "/markers": _cmd_markers,
+}
+
 def main():
     print("=" * 60)
     print("  SECOND BRAIN - ELSA Research Assistant")
@@ -86,46 +135,13 @@ def main():
         
         # Commands
         if user_input.startswith("/"):
-            cmd = user_input.lower().split()
-            
-            if cmd[0] == "/help":
-                print(HELP_TEXT)
-            
-            elif cmd[0] == "/quit":
-                print("Goodbye!")
+            cmd, *args = user_input.split()
+            handler = _CMDS.get(cmd.lower())
+            if handler is None:
+                print(f"\nUnknown command: {cmd}. Type /help for commands.\n")
+            elif handler(brain, args):
                 break
             
-            elif cmd[0] == "/index":
-                print("\nRe-indexing document...")
-                stats = brain.index_document()
-                print(f"Done! {stats['complete_sections']}/{stats['total_sections']} sections indexed.\n")
-            
-            elif cmd[0] == "/stats":
-                stats = brain.get_stats()
-                print(f"\nDocument Statistics:")
-                print(f"  Total sections: {stats['total_sections']}")
-                print(f"  Complete: {stats['complete_sections']}")
-                print(f"  Empty: {stats['empty_sections']}")
-                print(f"\nBy domain:")
-                for d, s in stats['domains'].items():
-                    print(f"  {d}: {s['complete']}/{s['total']} complete")
-                print()
-            
-            elif cmd[0] == "/gaps":
-                domain = cmd[1].upper() if len(cmd) > 1 else None
-                if domain and domain not in ["D1", "D2", "D3", "D4", "D5", "D6"]:
-                    print(f"\nInvalid domain: {domain}. Use D1-D6.\n")
-                else:
-                    print("\nAnalyzing gaps...")
-                    analysis = brain.gaps(domain)
-                    print(f"\n{analysis}\n")
-            
-            elif cmd[0] == "/markers":
-                print(brain.list_markers())
-            
-            else:
-                print(f"\nUnknown command: {cmd[0]}. Type /help for commands.\n")
-            
             continue
         
         # Remember command (natural language)
@@ -133,12 +149,10 @@ def main():
         if remember_content:
             content = remember_content
             
-            # Check if user specified a marker
-            if " in [" in content and content.endswith("]"):
-                # Parse explicit marker: "X in [D1:DEFINITION]"
-                parts = content.rsplit(" in ", 1)
-                note_content = parts[0]
-                marker = parts[1]
+            # Check if user specified a marker: "X in [D1:DEFINITION]"
+            explicit = split_explicit_marker(content)
+            if explicit:
+                note_content, marker = explicit
                 
                 print(f"\nBrain: Adding to {marker}...")
                 result = brain.confirm_remember(note_content, marker)
@@ -159,8 +173,10 @@ def main():
             continue
         
         # Regular query
-        response = brain.query(user_input)
-        print(f"\nBrain: {response}\n")
+        print("\nBrain: ", end="", flush=True)
+        for chunk in brain.query_stream(user_input):
+            print(chunk, end="", flush=True)
+        print("\n")
 
 
 if __name__ == "__main__":
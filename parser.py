@@ -1,62 +1,113 @@
 import re
-from dataclasses import dataclass
+from functools import lru_cache
+from dataclasses import dataclass, field
 from config import ALL_MARKERS, DOMAINS
 
-@dataclass
+try:
+    import ahocorasick  # optional: pip install pyahocorasick
+except ImportError:
+    ahocorasick = None
+
+@dataclass(slots=True)
 class Section:
     marker: str
     domain: str | None  # D1, D2, etc. or None for intro/conclusion
     section_type: str   # DEFINITION, MECHANISTIC EXPLANATION, etc.
     content: str
+    is_empty: bool = field(init=False)  # too short to count as written
+    
+    def __post_init__(self):
+        self.is_empty = not self.content or len(self.content) < 10
     
     def __str__(self):
         return f"{self.marker}\n{self.content[:100]}..."
 
-def parse_document(text: str, markers: list[str] = ALL_MARKERS) -> list[Section]:
-    """Parse document into sections based on markers."""
-    sections = []
+@dataclass
+class ParsedDoc:
+    """Sections in document order, plus lookup indexes built while parsing.
     
-    # Build regex pattern to split on markers
-    # Escape brackets for regex
-    escaped_markers = [re.escape(m) for m in markers]
-    pattern = f"({'|'.join(escaped_markers)})"
+    Iterates, indexes and len()s like the plain list of sections.
+    """
+    sections: list[Section] = field(default_factory=list)
+    by_marker: dict[str, Section] = field(default_factory=dict)  # first section per marker
+    by_domain: dict[str | None, list[Section]] = field(default_factory=dict)
     
-    # Split and keep delimiters
-    parts = re.split(pattern, text)
+    def __iter__(self):
+        return iter(self.sections)
     
-    # Process parts: marker followed by content
-    i = 0
-    while i < len(parts):
-        part = parts[i].strip()
-        
-        if part in markers:
-            marker = part
-            content = parts[i + 1] if i + 1 < len(parts) else ""
-            content = content.strip()
-            
-            # Parse marker to extract domain and section type
-            domain, section_type = parse_marker(marker)
-            
-            sections.append(Section(
-                marker=marker,
-                domain=domain,
-                section_type=section_type,
-                content=content
-            ))
-            i += 2
-        else:
-            i += 1
-    
-    return sections
+    def __len__(self):
+        return len(self.sections)
+    
+    def __getitem__(self, index):
+        return self.sections[index]
 
-def parse_marker(marker: str) -> tuple[str | None, str]:
-    """Extract domain and section type from marker.
+@lru_cache(maxsize=8)
+def _split_pattern(markers: tuple[str, ...]) -> re.Pattern:
+    """Internal: regex that splits on any of `markers`, keeping them as delimiters."""
+    # Escape brackets for regex
+    return re.compile("(" + "|".join(re.escape(m) for m in markers) + ")")
+
+_DEFAULT_SPLIT_RE = _split_pattern(tuple(ALL_MARKERS))
+
+def _build_automaton(markers: list[str]):
+    """Internal: Aho-Corasick automaton over the marker literals."""
+    automaton = ahocorasick.Automaton()
+    for m in markers:
+        automaton.add_word(m, m)
+    automaton.make_automaton()
+    return automaton
+
+_DEFAULT_AUTOMATON = _build_automaton(ALL_MARKERS) if ahocorasick else None
+
+def _split_on_markers(text: str, automaton) -> list[str]:
+    """Internal: same shape as the split regex's output, from one literal scan.
     
-    Examples:
-        [D1:DEFINITION] -> ("D1", "DEFINITION")
-        [INTRODUCTION] -> (None, "INTRODUCTION")
-        [CONCLUSION:SUMMARY] -> (None, "CONCLUSION:SUMMARY")
+    Returns [before, marker, content, marker, content, ...].
     """
+    parts = []
+    prev_end = 0
+    for end, marker in automaton.iter(text):
+        start = end - len(marker) + 1
+        if start < prev_end:  # overlaps the previous hit
+            continue
+        parts.append(text[prev_end:start])
+        parts.append(marker)
+        prev_end = end + 1
+    parts.append(text[prev_end:])
+    return parts
+
+def parse_document(text: str, markers: list[str] = ALL_MARKERS) -> ParsedDoc:
+    """Parse document into sections based on markers."""
+    doc = ParsedDoc()
+    
+    # Split and keep delimiters
+    if markers is ALL_MARKERS and _DEFAULT_AUTOMATON is not None:
+        parts = _split_on_markers(text, _DEFAULT_AUTOMATON)
+    elif markers is ALL_MARKERS:
+        parts = _DEFAULT_SPLIT_RE.split(text)
+    else:
+        parts = _split_pattern(tuple(markers)).split(text)
+    
+    # parts is [preamble, marker, content, marker, content, ...]:
+    # every odd index is a marker, so pair them up with their content
+    for marker, content in zip(parts[1::2], parts[2::2]):
+        # Parse marker to extract domain and section type
+        domain, section_type = parse_marker(marker)
+        
+        section = Section(
+            marker=marker,
+            domain=domain,
+            section_type=section_type,
+            content=content.strip()
+        )
+        doc.sections.append(section)
+        doc.by_marker.setdefault(marker, section)
+        doc.by_domain.setdefault(domain, []).append(section)
+    
+    return doc
+
+def _compute_marker_info(marker: str) -> tuple[str | None, str]:
+    """Internal: split a marker into (domain, section type)."""
     # Remove brackets
     inner = marker[1:-1]
     
@@ -69,35 +120,58 @@ def parse_marker(marker: str) -> tuple[str | None, str]:
     # Not a domain marker
     return (None, inner)
 
-def get_section_by_marker(sections: list[Section], marker: str) -> Section | None:
+# Every known marker parsed once at import time
+_MARKER_INFO = {m: _compute_marker_info(m) for m in ALL_MARKERS}
+
+def parse_marker(marker: str) -> tuple[str | None, str]:
+    """Extract domain and section type from marker.
+    
+    Examples:
+        [D1:DEFINITION] -> ("D1", "DEFINITION")
+        [INTRODUCTION] -> (None, "INTRODUCTION")
+        [CONCLUSION:SUMMARY] -> (None, "CONCLUSION:SUMMARY")
+    """
+    return _MARKER_INFO.get(marker) or _compute_marker_info(marker)
+
+def get_section_by_marker(sections: list[Section] | ParsedDoc, marker: str) -> Section | None:
     """Find a specific section by its marker."""
+    if isinstance(sections, ParsedDoc):
+        return sections.by_marker.get(marker)
+    
     for section in sections:
         if section.marker == marker:
             return section
     return None
 
-def get_sections_by_domain(sections: list[Section], domain: str) -> list[Section]:
+def get_sections_by_domain(sections: list[Section] | ParsedDoc, domain: str) -> list[Section]:
     """Get all sections for a specific domain (e.g., 'D1')."""
+    if isinstance(sections, ParsedDoc):
+        return list(sections.by_domain.get(domain, []))
+    
     return [s for s in sections if s.domain == domain]
 
 def get_empty_sections(sections: list[Section]) -> list[Section]:
     """Find sections with no content (for gap analysis)."""
-    return [s for s in sections if not s.content or len(s.content) < 10]
+    return [s for s in sections if s.is_empty]
 
 def get_document_stats(sections: list[Section]) -> dict:
     """Get overview statistics of document completeness."""
-    total = len(sections)
-    empty = len(get_empty_sections(sections))
+    total = 0
+    empty = 0
+    domain_stats = {domain_key: {"total": 0, "empty": 0} for domain_key in DOMAINS}
     
-    domain_stats = {}
-    for domain_key in DOMAINS:
-        domain_sections = get_sections_by_domain(sections, domain_key)
-        domain_empty = [s for s in domain_sections if not s.content or len(s.content) < 10]
-        domain_stats[domain_key] = {
-            "total": len(domain_sections),
-            "empty": len(domain_empty),
-            "complete": len(domain_sections) - len(domain_empty)
-        }
+    # Single pass over the sections
+    for s in sections:
+        total += 1
+        empty += s.is_empty
+        
+        counts = domain_stats.get(s.domain)
+        if counts is not None:
+            counts["total"] += 1
+            counts["empty"] += s.is_empty
+    
+    for counts in domain_stats.values():
+        counts["complete"] = counts["total"] - counts["empty"]
     
     return {
         "total_sections": total,
@@ -106,7 +180,6 @@ def get_document_stats(sections: list[Section]) -> dict:
         "domains": domain_stats
     }
 
-
 # Test
 if __name__ == "__main__":
     # Sample test
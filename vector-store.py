@@ -1,7 +1,34 @@
+import threading
+from collections import OrderedDict
+import numpy as np
 import chromadb
 from chromadb.config import Settings
 from config import CHROMA_DIR, EMBEDDING_MODEL
-from embeddings import get_embedding
+from embeddings import get_embedding, content_hash
+
+# Up to this many vectors, search scores every one with a single matrix
+# product; beyond it, defer to Chroma's HNSW index
+EXACT_SEARCH_MAX = 5000
+
+# Answers kept by the response cache, and how close (cosine distance) a new
+# question's embedding must be to a cached one (with the same sections
+# retrieved) to reuse its answer
+RESPONSE_CACHE_SIZE = 128
+RESPONSE_CACHE_MAX_DISTANCE = 0.05
+
+def _response_signature(results: list[dict]) -> str:
+    """Internal: digest of the sections an answer was generated from."""
+    return content_hash("\x1f".join(r["id"] for r in results))
+
+def _columns(embedded_sections: list[dict]) -> dict[str, list]:
+    """Pivot embedded sections into the parallel lists Chroma's batch calls take."""
+    columns = {"ids": [], "embeddings": [], "metadatas": [], "documents": []}
+    for s in embedded_sections:
+        columns["ids"].append(s["id"])
+        columns["embeddings"].append(s["embedding"])
+        columns["metadatas"].append(s["metadata"])
+        columns["documents"].append(s["document"])
+    return columns
 
 class VectorStore:
     def __init__(self, collection_name: str = "elsa_docs"):
@@ -14,28 +41,99 @@ class VectorStore:
             name=collection_name,
             metadata={"hnsw:space": "cosine"}
         )
-    
-    def clear(self):
-        """Clear all documents from collection."""
-        self.client.delete_collection(self.collection.name)
-        self.collection = self.client.get_or_create_collection(
-            name=self.collection.name,
+        # (unit-norm float32 matrix, ids, documents, metadatas), loaded on first search
+        self._exact = None
+        
+        # Answers to earlier questions: {cache id: answer} in LRU order, with
+        # the question embeddings mirrored in a side collection for
+        # near-duplicate lookups. An answer depends on the question and the
+        # sections retrieved for it, so both go into the key (see
+        # _response_signature). Answers only hold while the indexed content
+        # is unchanged, so every index write drops them and bumps
+        # _cache_generation (_invalidate).
+        self._response_cache = OrderedDict()
+        self._response_lock = threading.Lock()
+        self._cache_generation = 0
+        self._cache_collection = self.client.get_or_create_collection(
+            name="response_cache_embeddings",
             metadata={"hnsw:space": "cosine"}
         )
+        # Leftovers from an earlier run may predate the current index
+        stale = self._cache_collection.get(include=[])["ids"]
+        if stale:
+            self._cache_collection.delete(ids=stale)
+    
+    def _invalidate(self):
+        """Internal: drop everything derived from the indexed sections."""
+        self._exact = None
+        with self._response_lock:
+            self._cache_generation += 1
+            if self._response_cache:
+                self._cache_collection.delete(ids=list(self._response_cache))
+                self._response_cache.clear()
+    
+    def clear(self):
+        """Clear all documents from collection.
+        
+        Admin operation: indexing syncs the store in place (sync_documents)
+        and never needs this.
+        """
+        try:
+            existing = self.get_all_ids()
+            if existing:
+                self.collection.delete(ids=existing)
+        except Exception:
+            # Collection unreadable; rebuild it from scratch
+            self.client.delete_collection(self.collection.name)
+            self.collection = self.client.get_or_create_collection(
+                name=self.collection.name,
+                metadata={"hnsw:space": "cosine"}
+            )
+        self._invalidate()
     
     def add_documents(self, embedded_sections: list[dict]):
         """Add embedded sections to the store."""
         if not embedded_sections:
             return
         
-        self.collection.add(
-            ids=[s["id"] for s in embedded_sections],
-            embeddings=[s["embedding"] for s in embedded_sections],
-            metadatas=[s["metadata"] for s in embedded_sections],
-            documents=[s["document"] for s in embedded_sections]
-        )
+        self.collection.add(**_columns(embedded_sections))
+        self._invalidate()
         print(f"Added {len(embedded_sections)} sections to vector store")
     
+    def upsert_documents(self, embedded_sections: list[dict]):
+        """Insert or replace embedded sections by id."""
+        if not embedded_sections:
+            return
+        
+        self.collection.upsert(**_columns(embedded_sections))
+        self._invalidate()
+    
+    def delete_documents(self, ids: list[str]):
+        """Remove sections by id."""
+        if ids:
+            self.collection.delete(ids=list(ids))
+            self._invalidate()
+    
+    def get_content_hashes(self) -> dict[str, tuple[str, str]]:
+        """Return {marker: (content_hash, id)} for every stored section."""
+        return {
+            r["metadata"]["marker"]: (r["metadata"].get("content_hash"), r["id"])
+            for r in self.get_all_metadata()
+        }
+    
+    def sync_documents(self, embedded_sections: list[dict]):
+        """Make the store hold exactly `embedded_sections`.
+        
+        Sections with an embedding are upserted; those without (unchanged
+        since they were stored) are left alone; stored ids not in the list
+        are deleted.
+        """
+        current_ids = {s["id"] for s in embedded_sections}
+        stale_ids = set(self.get_all_ids()) - current_ids
+        self.delete_documents(list(stale_ids))
+        self.upsert_documents([s for s in embedded_sections if s["embedding"] is not None])
+        print(f"Synced vector store: {len(stale_ids)} removed")
+    
     def search(self, query: str, n_results: int = 5, domain_filter: str = None) -> list[dict]:
         """Search for relevant sections.
         
@@ -47,7 +145,77 @@ class VectorStore:
         Returns:
             List of matching sections with scores
         """
+        return self._search_embedding(get_embedding(query), n_results, domain_filter)
+    
+    def search_with_cache(self, query: str, n_results: int = 5, domain_filter: str = None) -> tuple[list[dict], str | None, tuple]:
+        """Search for relevant sections and look up a cached answer for them.
+        
+        Only meant for answers that don't depend on a conversation history;
+        the key covers just the question and the retrieved sections.
+        
+        Returns:
+            (search results, cached answer or None, cache key). The answer is
+            one given since the last index change to the same question, or
+            one within RESPONSE_CACHE_MAX_DISTANCE, with the same retrieved
+            sections. Pass the key to cache_response() to store a freshly
+            generated answer.
+        """
+        with self._response_lock:
+            generation = self._cache_generation
+        
         query_embedding = get_embedding(query)
+        results = self._search_embedding(query_embedding, n_results, domain_filter)
+        signature = _response_signature(results)
+        cache_id = content_hash(f"{signature}\0{query}")
+        key = (cache_id, query, signature, generation)
+        
+        with self._response_lock:
+            answer = self._response_cache.get(cache_id)
+            if answer is not None:
+                self._response_cache.move_to_end(cache_id)
+                return results, answer, key
+            
+            if self._response_cache:
+                hit = self._cache_collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=1,
+                    where={"signature": signature},
+                    include=["metadatas", "distances"]
+                )
+                if hit["ids"][0] and hit["distances"][0][0] < RESPONSE_CACHE_MAX_DISTANCE:
+                    if hit["ids"][0][0] in self._response_cache:
+                        self._response_cache.move_to_end(hit["ids"][0][0])
+                    return results, hit["metadatas"][0][0]["answer"], key
+        
+        return results, None, key
+    
+    def cache_response(self, key: tuple, answer: str):
+        """Remember `answer` under a key from search_with_cache().
+        
+        Dropped if the index changed since the lookup, since the answer
+        may have been generated from sections that are now outdated.
+        """
+        cache_id, query, signature, generation = key
+        with self._response_lock:
+            if generation != self._cache_generation:
+                return
+            if cache_id in self._response_cache:
+                self._response_cache.move_to_end(cache_id)
+            self._response_cache[cache_id] = answer
+            self._cache_collection.upsert(
+                ids=[cache_id],
+                embeddings=[get_embedding(query)],
+                metadatas=[{"query": query, "signature": signature, "answer": answer}]
+            )
+            # Evict least recently used beyond the cap
+            while len(self._response_cache) > RESPONSE_CACHE_SIZE:
+                evicted, _ = self._response_cache.popitem(last=False)
+                self._cache_collection.delete(ids=[evicted])
+    
+    def _search_embedding(self, query_embedding: list[float], n_results: int, domain_filter: str = None) -> list[dict]:
+        """Internal: search() for an already-embedded query."""
+        if self._exact is not None or self.count() <= EXACT_SEARCH_MAX:
+            return self._search_exact(query_embedding, n_results, domain_filter)
         
         where_filter = None
         if domain_filter:
@@ -60,31 +228,84 @@ class VectorStore:
             include=["documents", "metadatas", "distances"]
         )
         
-        # Format results
-        formatted = []
-        for i in range(len(results["ids"][0])):
-            formatted.append({
-                "id": results["ids"][0][i],
-                "document": results["documents"][0][i],
-                "metadata": results["metadatas"][0][i],
-                "distance": results["distances"][0][i],  # Lower = more similar
-            })
+        # Format results (one query, so everything is at index 0)
+        ids, documents, metadatas, distances = (
+            results["ids"][0], results["documents"][0],
+            results["metadatas"][0], results["distances"][0]
+        )
+        return [
+            {
+                "id": section_id,
+                "document": document,
+                "metadata": metadata,
+                "distance": distance,  # Lower = more similar
+            }
+            for section_id, document, metadata, distance in zip(ids, documents, metadatas, distances)
+        ]
+    
+    def _search_exact(self, query_embedding: list[float], n_results: int, domain_filter: str = None) -> list[dict]:
+        """Internal: brute-force cosine search over every stored vector.
+        
+        Distances match Chroma's cosine space (1 - cosine similarity).
+        """
+        if self._exact is None:
+            results = self.collection.get(include=["embeddings", "documents", "metadatas"])
+            matrix = np.asarray(results["embeddings"], dtype=np.float32)
+            if matrix.size:
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                matrix /= np.where(norms == 0, 1, norms)
+            self._exact = (matrix, results["ids"], results["documents"], results["metadatas"])
+        matrix, ids, documents, metadatas = self._exact
+        
+        if not ids:
+            return []
+        
+        candidates = np.arange(len(ids))
+        if domain_filter:
+            candidates = np.array([i for i, m in enumerate(metadatas) if m.get("domain") == domain_filter], dtype=np.intp)
+            if not len(candidates):
+                return []
+        
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        scores = matrix[candidates] @ query
+        
+        # Top-k without a full sort, then order just those k
+        k = min(n_results, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        
+        return [
+            {
+                "id": ids[candidates[i]],
+                "document": documents[candidates[i]],
+                "metadata": metadatas[candidates[i]],
+                "distance": float(1 - scores[i]),  # Lower = more similar
+            }
+            for i in top
+        ]
+    
+    def get_all_ids(self) -> list[str]:
+        """Retrieve every stored id, without loading documents or metadata."""
+        return self.collection.get(include=[])["ids"]
+    
+    def get_all_metadata(self) -> list[dict]:
+        """Retrieve ids and metadata only, skipping the document text."""
+        results = self.collection.get(include=["metadatas"])
         
-        return formatted
+        return [
+            {"id": section_id, "metadata": metadata}
+            for section_id, metadata in zip(results["ids"], results["metadatas"])
+        ]
     
     def get_all_documents(self) -> list[dict]:
         """Retrieve all documents (for debugging/overview)."""
         results = self.collection.get(include=["documents", "metadatas"])
         
-        formatted = []
-        for i in range(len(results["ids"])):
-            formatted.append({
-                "id": results["ids"][i],
-                "document": results["documents"][i],
-                "metadata": results["metadatas"][i],
-            })
-        
-        return formatted
+        return [
+            {"id": section_id, "document": document, "metadata": metadata}
+            for section_id, document, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+        ]
     
     def count(self) -> int:
         """Return number of documents in store."""